@@ -1,13 +1,38 @@
 import os
-import base64
-from openai import AsyncOpenAI, APIError, APITimeoutError, RateLimitError
+import asyncio
+import binascii
+import orjson
+from openai import AsyncOpenAI, APIError, APITimeoutError, RateLimitError, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 import io
+import threading
+from collections import OrderedDict
 from PIL import Image
-from typing import List, Tuple, Optional
+from typing import AsyncIterator, List, Tuple, Optional
+
+try:
+    import numpy as np
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420, TJFLAG_PROGRESSIVE
+    _turbojpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # PyTurboJPEG or the libjpeg-turbo shared library isn't available, use PIL's encoder instead
+    _turbojpeg = None
+print(f"JPEG encoder: {'libjpeg-turbo (PyTurboJPEG)' if _turbojpeg is not None else 'PIL'}")
 
 load_dotenv()
 
+class OrjsonAsyncHttpxClient(DefaultAsyncHttpxClient):
+    """
+    HTTP client that serializes JSON request bodies with orjson instead of the stdlib json module.
+    Chat requests carry megabytes of base64 image data, which orjson encodes several times faster.
+    Only applies to SDK versions that hand the body to httpx as json=, newer ones pass pre-encoded content.
+    """
+
+    def build_request(self, *args, json=None, **kwargs):
+        if json is not None and kwargs.get("content") is None:
+            kwargs["content"] = orjson.dumps(json)
+        return super().build_request(*args, **kwargs)
+
 # Initialize OpenAI client with OpenRouter configuration
 api_key = os.getenv("OPENROUTER_API_KEY")
 if not api_key:
@@ -16,13 +41,24 @@ if not api_key:
 client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=api_key,
+    http_client=OrjsonAsyncHttpxClient(),
 )
 
+MODEL = "anthropic/claude-sonnet-4"
+
 # Claude image constraints
 MAX_DIMENSION = 7990  # Keeping slightly under 8000px to be safe
 MAX_BASE64_SIZE_BYTES = 5 * 1024 * 1024  # 5MB in bytes
+MAX_JPEG_SIZE_BYTES = MAX_BASE64_SIZE_BYTES * 3 // 4  # Largest JPEG whose base64 encoding fits
 JPEG_QUALITY = 85  # Default JPEG quality
+MIN_JPEG_QUALITY = 20  # Don't go below this quality when shrinking a slice
+PROBE_JPEG_QUALITY = 50  # Quality of the low-res probe encode used to predict slice size
+QUALITY_SIZE_EXPONENT = 1.4  # JPEG size grows roughly as quality ** 1.4
+QUALITY_FILL_RATIO = 0.9  # A fitting encode using at least this share of the size limit isn't worth raising quality for
+QUALITY_CACHE_SIZE = 512  # Number of (url, slice) entries to remember the chosen JPEG quality for
 MIME_TYPE = "data:image/jpeg;base64,"  # Correct MIME type for JPEG images
+BASE64_CHUNK_SIZE = 57 * 1024  # Input bytes per base64 chunk, must be a multiple of 3
+MAX_PARALLEL_ENCODES = min(4, os.cpu_count() or 2)  # Slices cropped and encoded at once, each holds its own band copy
 
 SYSTEM_PROMPT = """You are an expert frontend web developer with perfect visual perception and attention to detail.
 
@@ -56,155 +92,314 @@ Instructions:
 
 Output only a full standalone HTML file that combines all segments into a cohesive webpage."""
 
+# Per-thread JPEG output buffer, reused across encodes to avoid regrowing a multi-MB buffer each time
+_encode_buffer = threading.local()
+
+# LRU of the JPEG quality that worked last time for a given (url, width, height, slice_num),
+# used as the starting point for repeat screenshots of the same page instead of a probe encode.
+# Still corrected in both directions, since a page can render lighter or heavier than last time
+_quality_cache: "OrderedDict[Tuple[str, int, int, int], int]" = OrderedDict()
+_quality_cache_lock = threading.Lock()
+
 class ImageValidationError(Exception):
     """Custom exception for image validation failures"""
     pass
 
-def validate_and_optimize_slice(img_slice: Image.Image, slice_num: int = 0) -> str:
+def encode_jpeg(img: Image.Image, quality: int) -> io.BytesIO:
+    """
+    Encodes an image as a progressive, Huffman-optimized JPEG into this thread's reusable buffer.
+    Uses libjpeg-turbo's SIMD encoder for RGB images when available, PIL otherwise.
+    Returns the buffer positioned at the end of the data, which stays valid until the next call on the same thread.
+    """
+    buffer = getattr(_encode_buffer, 'buffer', None)
+    if buffer is None:
+        buffer = _encode_buffer.buffer = io.BytesIO()
+
+    # Overwrite in place and truncate afterwards, truncating to 0 first would free the allocation
+    buffer.seek(0)
+    if _turbojpeg is not None and img.mode == 'RGB':
+        buffer.write(_turbojpeg.encode(
+            np.asarray(img),
+            quality=quality,
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420,
+            flags=TJFLAG_PROGRESSIVE,
+        ))
+    else:
+        img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True, subsampling='4:2:0')
+    buffer.truncate()
+    return buffer
+
+def encode_data_url(data) -> str:
+    """
+    Base64 encodes JPEG data straight into a preallocated data URL buffer.
+    Returns the finished data URL, without building a separate base64 string and concatenating it.
+    """
+    prefix = MIME_TYPE.encode('ascii')
+    out = bytearray(len(prefix) + (len(data) + 2) // 3 * 4)
+    out[:len(prefix)] = prefix
+
+    # Encode chunk by chunk so only a small temporary exists instead of a second full-size copy.
+    # Chunks are a multiple of 3 bytes, so padding can only appear at the very end
+    pos = len(prefix)
+    with memoryview(data) as view:
+        for start in range(0, len(view), BASE64_CHUNK_SIZE):
+            encoded = binascii.b2a_base64(view[start:start + BASE64_CHUNK_SIZE], newline=False)
+            out[pos:pos + len(encoded)] = encoded
+            pos += len(encoded)
+    return out.decode('ascii')
+
+def predict_jpeg_quality(img_slice: Image.Image) -> int:
+    """
+    Predicts the highest JPEG quality that keeps the slice under the base64 size limit.
+    Uses a single probe encode of a half-resolution copy instead of encoding the full slice repeatedly.
+    """
+    width, height = img_slice.size
+    probe = img_slice.resize((max(1, width // 2), max(1, height // 2)), Image.BILINEAR)
+    probe_size = encode_jpeg(probe, PROBE_JPEG_QUALITY).tell()
+
+    # Size scales with pixel count (4x the probe) and roughly with quality ** 1.4
+    quality = PROBE_JPEG_QUALITY * (MAX_JPEG_SIZE_BYTES / (probe_size * 4)) ** (1 / QUALITY_SIZE_EXPONENT)
+    return max(MIN_JPEG_QUALITY, min(JPEG_QUALITY, int(quality)))
+
+def get_cached_quality(key: Tuple[str, int, int, int]) -> Optional[int]:
+    """
+    Returns the JPEG quality cached for a slice as a starting guess, or None if there is none.
+    """
+    with _quality_cache_lock:
+        quality = _quality_cache.get(key)
+        if quality is not None:
+            _quality_cache.move_to_end(key)
+        return quality
+
+def cache_quality(key: Tuple[str, int, int, int], quality: int) -> None:
+    """
+    Remembers the JPEG quality used for a slice, evicting the least recently used entry when full.
+    """
+    with _quality_cache_lock:
+        _quality_cache[key] = quality
+        _quality_cache.move_to_end(key)
+        if len(_quality_cache) > QUALITY_CACHE_SIZE:
+            _quality_cache.popitem(last=False)
+
+def validate_and_optimize_slice(img_slice: Image.Image, slice_num: int = 0, url: Optional[str] = None) -> str:
     """
     Validates and optimizes an image slice according to Claude's requirements.
-    Returns base64 encoded string if valid, raises ImageValidationError if not.
+    Slices over MAX_DIMENSION are downscaled to fit.
+    Returns a base64 JPEG data URL if valid, raises ImageValidationError if not.
     """
-    # Check dimensions
+    # Check dimensions, downscaling in place rather than rejecting an oversized slice
     width, height = img_slice.size
     if width >= MAX_DIMENSION or height >= MAX_DIMENSION:
-        raise ImageValidationError(f"Slice {slice_num} dimensions ({width}x{height}) exceed {MAX_DIMENSION}px limit")
-
-    # Start with high quality and gradually reduce if needed
-    quality = JPEG_QUALITY
-    while quality >= 20:  # Don't go below quality 20
-        buffer = io.BytesIO()
-        img_slice.save(buffer, format='JPEG', quality=quality, optimize=True)
-        base64_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        # Check size
-        if len(base64_data) <= MAX_BASE64_SIZE_BYTES:
-            print(f"Slice {slice_num}: {width}x{height}, Quality: {quality}, Size: {len(base64_data)/1024/1024:.2f}MB")
-            return base64_data
-            
-        quality -= 5  # Reduce quality and try again
-    
-    raise ImageValidationError(f"Slice {slice_num} cannot be compressed to under 5MB even at lowest quality")
+        img_slice.thumbnail((MAX_DIMENSION - 10, MAX_DIMENSION - 10), Image.LANCZOS)
+        print(f"Slice {slice_num}: downscaled from {width}x{height} to {img_slice.width}x{img_slice.height}")
+        width, height = img_slice.size
+
+    # Start from the cached or predicted quality, the prediction is only a starting point
+    cache_key = (url, width, height, slice_num) if url else None
+    quality = get_cached_quality(cache_key) if cache_key else None
+    if quality is None:
+        quality = predict_jpeg_quality(img_slice)
 
-def slice_image(base64_string: str) -> List[str]:
+    # Correct it in either direction using the size of each full encode, stopping once a fitting
+    # encode is close enough to the limit. Falls back to bisection if a guess leaves the search range
+    best_quality = None
+    low, high = MIN_JPEG_QUALITY, JPEG_QUALITY
+    while True:
+        buffer = encode_jpeg(img_slice, quality)
+        size = buffer.tell()
+        if size <= MAX_JPEG_SIZE_BYTES:
+            best_quality = quality
+            low = quality + 1
+            if size >= MAX_JPEG_SIZE_BYTES * QUALITY_FILL_RATIO:
+                break
+        else:
+            high = quality - 1
+        if low > high:
+            break
+        guess = int(quality * (MAX_JPEG_SIZE_BYTES / size) ** (1 / QUALITY_SIZE_EXPONENT))
+        if guess > high == JPEG_QUALITY:
+            # Overshooting the default quality means it most likely fits, try it directly
+            guess = high
+        quality = guess if low <= guess <= high else (low + high) // 2
+
+    if best_quality is None:
+        raise ImageValidationError(f"Slice {slice_num} cannot be compressed to under 5MB even at lowest quality")
+    if best_quality != quality:
+        # The buffer holds the last attempt, not the best one
+        quality = best_quality
+        buffer = encode_jpeg(img_slice, quality)
+
+    if cache_key:
+        cache_quality(cache_key, quality)
+
+    # Encode straight from the buffer without copying the JPEG into a bytes object first
+    with buffer.getbuffer() as jpeg_view:
+        data_url = encode_data_url(jpeg_view)
+    print(f"Slice {slice_num}: {width}x{height}, Quality: {quality}, Size: {(len(data_url) - len(MIME_TYPE))/1024/1024:.2f}MB")
+    return data_url
+
+def encode_band(img: Image.Image, slice_num: int, box: Optional[Tuple[int, int, int, int]] = None,
+                url: Optional[str] = None) -> str:
+    """
+    Crops a horizontal band out of a decoded image, converts it to RGB if needed and encodes it.
+    Only the band is copied, on top of the shared decoded source.
+    """
+    band = img.crop(box) if box else img
+    # Drop alpha channel / palette, which JPEG can't store
+    if band.mode not in ('RGB', 'L'):
+        band = band.convert('RGB')
+    return validate_and_optimize_slice(band, slice_num, url)
+
+async def slice_image(image_data: bytes, url: Optional[str] = None) -> List[str]:
     """
     Slice an image into segments if its height exceeds MAX_DIMENSION.
-    Returns a list of base64-encoded image segments, each validated against Claude's requirements.
+    The page URL, if given, is used to reuse the JPEG quality picked for the same page before.
+    Returns a list of base64 JPEG data URLs, one per segment, each validated against Claude's requirements.
     """
     try:
-        # Decode base64 to bytes
-        image_data = base64.b64decode(base64_string)
-        
-        # Open with Pillow
+        # Open with Pillow (only reads the header, pixels are decoded lazily)
         with Image.open(io.BytesIO(image_data)) as img:
-            # Convert to RGB (removing alpha channel if present)
-            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                img = img.convert('RGB')
-            
             width, height = img.size
             print(f"Original image dimensions: {width}x{height}")
-            
+
+            # An RGB or grayscale JPEG that already satisfies the limits can be sent as-is,
+            # no need to decode and re-encode it. This is the common single-slice case
+            if (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+                    and width < MAX_DIMENSION and height < MAX_DIMENSION
+                    and len(image_data) <= MAX_JPEG_SIZE_BYTES):
+                data_url = encode_data_url(image_data)
+                print(f"Using source JPEG as-is, Size: {(len(data_url) - len(MIME_TYPE))/1024/1024:.2f}MB")
+                return [data_url]
+
+            # Decode the source once, off the event loop. Each encode then copies out
+            # only its own band, so no full-size RGB copy is made
+            await asyncio.to_thread(img.load)
+
             # If image is within limits, validate and return as single slice
-            if height <= MAX_DIMENSION:
-                return [validate_and_optimize_slice(img)]
-            
-            # Calculate number of slices needed
-            num_slices = (height + MAX_DIMENSION - 1) // MAX_DIMENSION
-            slice_height = height // num_slices
-            print(f"Slicing into {num_slices} segments of ~{slice_height}px height")
-            
-            # Create slices
-            slices = []
-            for i in range(num_slices):
-                top = i * slice_height
-                # For the last slice, use the remaining height
-                bottom = min((i + 1) * slice_height, height)
-                
-                # Crop and validate each slice
-                slice_img = img.crop((0, top, width, bottom))
-                slice_base64 = validate_and_optimize_slice(slice_img, i + 1)
-                slices.append(slice_base64)
-            
-            return slices
-            
+            if height < MAX_DIMENSION:
+                return [await asyncio.to_thread(encode_band, img, 0, None, url)]
+
+            # Calculate number of slices needed, keeping every slice under MAX_DIMENSION
+            num_slices = (height + MAX_DIMENSION - 2) // (MAX_DIMENSION - 1)
+            print(f"Slicing into {num_slices} segments of ~{height // num_slices}px height")
+
+            # Spread the rows evenly so the last slice also gets the remainder
+            boxes = [
+                (0, i * height // num_slices, width, (i + 1) * height // num_slices)
+                for i in range(num_slices)
+            ]
+
+            # Crop, validate and encode slices in parallel, PIL releases the GIL while encoding.
+            # At most MAX_PARALLEL_ENCODES bands are cropped at once, so the crops of a very tall
+            # page don't all sit in memory together
+            slots = asyncio.Semaphore(MAX_PARALLEL_ENCODES)
+
+            async def encode_band_bounded(slice_num: int, box: Tuple[int, int, int, int]) -> str:
+                async with slots:
+                    return await asyncio.to_thread(encode_band, img, slice_num, box, url)
+
+            return list(await asyncio.gather(*(
+                encode_band_bounded(i + 1, box)
+                for i, box in enumerate(boxes)
+            )))
+
     except Exception as e:
         print(f"Error processing image: {str(e)}")
         raise
 
-async def analyze_screenshot(image_base64: str) -> Optional[str]:
+def build_messages(image_slices: List[str]) -> List[dict]:
     """
-    Analyze a screenshot using OpenRouter's Claude Sonnet model and return HTML code.
-    Returns None if the analysis fails.
+    Builds the OpenRouter chat messages for one or more screenshot slice data URLs.
     """
-    try:
-        # Slice the image if needed
-        image_slices = slice_image(image_base64)
-        print(f"Number of slices: {len(image_slices)}")
-        
-        if len(image_slices) == 1:
-            # Single image case
-            messages = [
-                {
-                    "role": "system",
-                    "content": SYSTEM_PROMPT
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Please analyze this webpage screenshot and generate the HTML code to recreate it."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"{MIME_TYPE}{image_slices[0]}"
-                            }
+    if len(image_slices) == 1:
+        # Single image case
+        return [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Please analyze this webpage screenshot and generate the HTML code to recreate it."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_slices[0]
                         }
-                    ]
-                }
-            ]
-        else:
-            # Multiple slices case
-            content = [
+                    }
+                ]
+            }
+        ]
+    else:
+        # Multiple slices case
+        # Build the whole list in one go, a label followed by the image for each segment
+        num_slices = len(image_slices)
+        content = [
+            {
+                "type": "text",
+                "text": "Please analyze these webpage screenshot segments and generate the HTML code to recreate the complete page."
+            }
+        ] + [
+            part
+            for i, slice_url in enumerate(image_slices)
+            for part in (
                 {
                     "type": "text",
-                    "text": "Please analyze these webpage screenshot segments and generate the HTML code to recreate the complete page."
-                }
-            ]
-            for i, slice_base64 in enumerate(image_slices):
-                content.append({
-                    "type": "text",
-                    "text": f"Segment {i+1} of {len(image_slices)}:"
-                })
-                content.append({
+                    "text": f"Segment {i+1} of {num_slices}:"
+                },
+                {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"{MIME_TYPE}{slice_base64}"
+                        "url": slice_url
                     }
-                })
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": MULTI_IMAGE_SYSTEM_PROMPT
-                },
-                {
-                    "role": "user",
-                    "content": content
                 }
-            ]
+            )
+        ]
+
+        return [
+            {
+                "role": "system",
+                "content": MULTI_IMAGE_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+
+def openrouter_headers() -> dict:
+    """
+    Returns the extra headers OpenRouter uses to attribute requests to this app.
+    """
+    return {
+        "HTTP-Referer": os.getenv("HTTP_REFERER", "http://localhost:3000"),
+        "X-Title": "Orchids Challenge",
+    }
+
+async def analyze_screenshot(image_data: bytes, url: Optional[str] = None) -> Optional[str]:
+    """
+    Analyze a screenshot using OpenRouter's Claude Sonnet model and return HTML code.
+    Returns None if the analysis fails.
+    """
+    try:
+        # Slice the image if needed
+        image_slices = await slice_image(image_data, url)
+        print(f"Number of slices: {len(image_slices)}")
+        
+        messages = build_messages(image_slices)
 
         # Make API call with proper error handling
         try:
             print("Making API call to OpenRouter...")
             response = await client.chat.completions.create(
-                model="anthropic/claude-sonnet-4",
+                model=MODEL,
                 messages=messages,
-                extra_headers={
-                    "HTTP-Referer": os.getenv("HTTP_REFERER", "http://localhost:3000"),
-                    "X-Title": "Orchids Challenge",
-                }
+                extra_headers=openrouter_headers()
             )
             print(f"API Response: {response}")
             
@@ -249,4 +444,44 @@ async def analyze_screenshot(image_base64: str) -> Optional[str]:
         raise
     except Exception as e:
         print(f"Error analyzing screenshot: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+async def stream_screenshot_analysis(image_data: bytes, url: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Analyze a screenshot like analyze_screenshot, but stream the completion from OpenRouter.
+    Yields the generated HTML in chunks as they arrive.
+    """
+    try:
+        # Slice the image if needed
+        image_slices = await slice_image(image_data, url)
+        print(f"Number of slices: {len(image_slices)}")
+
+        messages = build_messages(image_slices)
+
+        try:
+            print("Making streaming API call to OpenRouter...")
+            stream = await client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                extra_headers=openrouter_headers(),
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        except APIError as e:
+            print(f"API Error while streaming: {str(e)}")
+            print(f"Full error details: {e.__dict__}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error while streaming: {str(e)}")
+            print(f"Error type: {type(e)}")
+            raise
+
+    except ImageValidationError as e:
+        print(f"Image validation error: {str(e)}")
+        raise
+    except Exception as e:
+        print(f"Error analyzing screenshot: {str(e)}")
+        raise
@@ -1,15 +1,50 @@
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, HttpUrl
+from playwright.async_api import Browser, async_playwright
 from typing import Dict, List, Optional
 from app.screenshot import take_full_page_screenshot
-from app.llm import analyze_screenshot
+from app.llm import analyze_screenshot, stream_screenshot_analysis
+
+# Serializes relaunching the shared browser, so concurrent requests don't each start a new one
+_browser_lock = asyncio.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Launch one Chromium for the lifetime of the app instead of one per screenshot"""
+    async with async_playwright() as p:
+        app.state.playwright = p
+        app.state.browser = await p.chromium.launch(headless=True)
+        try:
+            yield
+        finally:
+            try:
+                await app.state.browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {str(e)}")
+
+async def get_browser() -> Browser:
+    """Returns the shared browser, relaunching it first if Chromium crashed or disconnected"""
+    if app.state.browser.is_connected():
+        return app.state.browser
+    async with _browser_lock:
+        # Another request may have relaunched it while this one waited for the lock
+        if not app.state.browser.is_connected():
+            print("Browser disconnected, relaunching Chromium")
+            app.state.browser = await app.state.playwright.chromium.launch(headless=True)
+        return app.state.browser
 
 # Create FastAPI instance
 app = FastAPI(
     title="Orchids Challenge API",
     description="A starter FastAPI template for the Orchids Challenge backend",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware - More permissive for development
@@ -40,27 +75,31 @@ class ItemCreate(BaseModel):
     name: str
     description: str = None
 
-# In-memory storage for demo purposes
-items_db: List[Item] = [
-    Item(id=1, name="Sample Item", description="This is a sample item"),
-    Item(id=2, name="Another Item", description="This is another sample item")
-]
+# In-memory storage for demo purposes, keyed by item id
+items_db: Dict[int, Item] = {
+    1: Item(id=1, name="Sample Item", description="This is a sample item"),
+    2: Item(id=2, name="Another Item", description="This is another sample item")
+}
+_next_id = 3  # Next id to hand out, tracked so create_item doesn't scan items_db
 
 # Screenshot endpoint
 @app.post("/screenshot", response_model=ScreenshotResponse)
 async def take_screenshot(request: ScreenshotRequest):
     try:
         # Take screenshot
-        image_data = await take_full_page_screenshot(str(request.url))
-        if not image_data:
+        screenshot_bytes = await take_full_page_screenshot(str(request.url), await get_browser())
+        if not screenshot_bytes:
             raise HTTPException(
                 status_code=500, 
                 detail="Failed to capture screenshot. The URL might be invalid or the page might be blocking automated access."
             )
             
+        # The raw bytes go to the LLM, only the HTTP response needs base64
+        image_data = base64.b64encode(screenshot_bytes).decode('utf-8')
+
         # Analyze with LLM
         try:
-            generated_html = await analyze_screenshot(image_data)
+            generated_html = await analyze_screenshot(screenshot_bytes, str(request.url))
         except Exception as e:
             print(f"LLM analysis failed: {str(e)}")
             # Return a more informative error message
@@ -85,6 +124,33 @@ async def take_screenshot(request: ScreenshotRequest):
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+def sse_event(event: str, data: str) -> str:
+    """Format a server-sent event, JSON-encoding the data so newlines can't break the framing"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming screenshot endpoint, sends the generated HTML as it arrives
+@app.post("/screenshot/stream")
+async def stream_screenshot(request: ScreenshotRequest):
+    screenshot_bytes = await take_full_page_screenshot(str(request.url), await get_browser())
+    if not screenshot_bytes:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to capture screenshot. The URL might be invalid or the page might be blocking automated access."
+        )
+
+    async def events():
+        yield sse_event("screenshot", base64.b64encode(screenshot_bytes).decode('utf-8'))
+        try:
+            async for chunk in stream_screenshot_analysis(screenshot_bytes, str(request.url)):
+                yield sse_event("html", chunk)
+        except Exception as e:
+            print(f"LLM analysis failed: {str(e)}")
+            yield sse_event("error", "Screenshot captured but HTML generation failed")
+            return
+        yield sse_event("done", "Screenshot captured and HTML generated successfully")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -98,41 +164,40 @@ async def health_check():
 # Get all items
 @app.get("/items", response_model=List[Item])
 async def get_items():
-    return items_db
+    return list(items_db.values())
 
 # Get item by ID
 @app.get("/items/{item_id}", response_model=Item)
 async def get_item(item_id: int):
-    for item in items_db:
-        if item.id == item_id:
-            return item
+    if item_id in items_db:
+        return items_db[item_id]
     return {"error": "Item not found"}
 
 # Create new item
 @app.post("/items", response_model=Item)
 async def create_item(item: ItemCreate):
-    new_id = max([item.id for item in items_db], default=0) + 1
+    global _next_id
+    new_id = _next_id
+    _next_id += 1
     new_item = Item(id=new_id, **item.dict())
-    items_db.append(new_item)
+    items_db[new_id] = new_item
     return new_item
 
 # Update item
 @app.put("/items/{item_id}", response_model=Item)
 async def update_item(item_id: int, item: ItemCreate):
-    for i, existing_item in enumerate(items_db):
-        if existing_item.id == item_id:
-            updated_item = Item(id=item_id, **item.dict())
-            items_db[i] = updated_item
-            return updated_item
+    if item_id in items_db:
+        updated_item = Item(id=item_id, **item.dict())
+        items_db[item_id] = updated_item
+        return updated_item
     return {"error": "Item not found"}
 
 # Delete item
 @app.delete("/items/{item_id}")
 async def delete_item(item_id: int):
-    for i, item in enumerate(items_db):
-        if item.id == item_id:
-            deleted_item = items_db.pop(i)
-            return {"message": f"Item {item_id} deleted successfully", "deleted_item": deleted_item}
+    if item_id in items_db:
+        deleted_item = items_db.pop(item_id)
+        return {"message": f"Item {item_id} deleted successfully", "deleted_item": deleted_item}
     return {"error": "Item not found"}
 
 if __name__ == "__main__":
@@ -1,124 +1,198 @@
-from playwright.async_api import async_playwright, Browser
-import base64
+from playwright.async_api import Browser
 from typing import Optional
 import asyncio
+import re
 
-async def take_full_page_screenshot(url: str) -> Optional[str]:
+SCREENSHOT_JPEG_QUALITY = 90  # Chromium-side JPEG quality for captured screenshots
+SCROLL_QUIET_MS = 200  # Move on once nothing changed on the page for this long after a scroll step
+SCROLL_MAX_WAIT_MS = 800  # Upper bound on the wait after each scroll step
+
+# Ad, analytics and tracking hosts, which add load time but nothing visible worth recreating
+BLOCKED_DOMAINS = (
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com',
+    'googletagmanager.com', 'connect.facebook.net', 'amazon-adsystem.com', 'adnxs.com', 'criteo.com',
+    'taboola.com', 'outbrain.com', 'scorecardresearch.com', 'quantserve.com', 'hotjar.com',
+    'clarity.ms', 'segment.io', 'segment.com', 'mixpanel.com', 'amplitude.com', 'fullstory.com',
+    'newrelic.com', 'nr-data.net',
+)
+# Requests to the blocked hosts, plus video/audio files which only show up as a poster frame.
+# A URL pattern (rather than a catch-all handler) lets Playwright filter requests itself,
+# so only blocked requests make a round-trip to Python
+BLOCKED_URL_PATTERN = re.compile(
+    r'^[a-z]+://([^/?#]*\.)?(' + '|'.join(re.escape(domain) for domain in BLOCKED_DOMAINS) + r')(:\d+)?([/?#]|$)'
+    r'|\.(mp4|webm|ogv|mov|mp3|wav|m4a|m3u8|mpd)([?#]|$)',
+    re.IGNORECASE,
+)
+
+# Taller pages are captured at 1x: at 2x they would need slicing and heavy JPEG compression downstream,
+# which throws away the extra detail anyway
+HIGH_DPI_MAX_PAGE_HEIGHT = 3990
+
+# Scrolls through the page in half-viewport steps, waiting after each step until the DOM and
+# image loads have been quiet for a moment, scrolls back to the top and waits for all images
+# and (deduplicated) background images to load. Returns the final page height in CSS pixels
+LAZY_LOADING_SCRIPT = r'''
+async ({ quietMs, maxWaitMs }) => {
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+
+    // Track the last time the DOM changed or a resource finished loading
+    let lastChange = performance.now();
+    const markChange = () => { lastChange = performance.now(); };
+    const observer = new MutationObserver(markChange);
+    observer.observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        attributeFilter: ['src', 'srcset', 'style', 'class'],
+    });
+    document.addEventListener('load', markChange, true);
+
+    // Resolve once nothing changed for quietMs, or after maxWaitMs at most
+    const waitForQuiet = async () => {
+        const start = lastChange = performance.now();
+        for (;;) {
+            const now = performance.now();
+            const quietLeft = quietMs - (now - lastChange);
+            const maxLeft = maxWaitMs - (now - start);
+            if (quietLeft <= 0 || maxLeft <= 0) return;
+            await sleep(Math.min(quietLeft, maxLeft));
+        }
+    };
+
+    // Scroll in smaller steps for smoother loading
+    try {
+        const pageHeight = document.documentElement.scrollHeight;
+        const stepSize = Math.max(1, Math.floor(window.innerHeight / 2));
+        for (let y = 0; y < pageHeight; y += stepSize) {
+            window.scrollTo(0, y);
+            await waitForQuiet();
+        }
+    } finally {
+        observer.disconnect();
+        document.removeEventListener('load', markChange, true);
+    }
+
+    // Scroll back to top
+    window.scrollTo(0, 0);
+
+    // Collect every background image URL once, many elements share the same one
+    const backgroundUrls = new Set();
+    for (const el of document.querySelectorAll('*')) {
+        const backgroundImage = window.getComputedStyle(el).backgroundImage;
+        if (!backgroundImage || backgroundImage === 'none') continue;
+        for (const match of backgroundImage.matchAll(/url\(["']?(.*?)["']?\)/g)) {
+            backgroundUrls.add(match[1]);
+        }
+    }
+
+    const waitFor = img => new Promise(resolve => {
+        img.addEventListener('load', resolve, { once: true });
+        img.addEventListener('error', resolve, { once: true });
+    });
+    await Promise.all([
+        // Wait for all images
+        ...Array.from(document.images).filter(img => !img.complete).map(waitFor),
+        // Wait for background images
+        ...Array.from(backgroundUrls).map(src => {
+            const img = new Image();
+            const loaded = waitFor(img);
+            img.src = src;
+            return loaded;
+        }),
+    ]);
+
+    return document.documentElement.scrollHeight;
+}
+'''
+
+async def take_full_page_screenshot(url: str, browser: Browser) -> Optional[bytes]:
     """
     Takes a full-page screenshot of the given URL using Playwright.
-    Returns base64 encoded PNG image or None if failed.
+    Uses the shared browser, with a fresh context per call so requests don't share cookies or storage.
+    Returns the JPEG image bytes or None if failed.
     """
-    browser = None
+    context = None
     try:
-        async with async_playwright() as p:
-            # Launch browser with specific configurations
-            browser = await p.chromium.launch(
-                headless=True,
-            )
-            
-            # Create a new page with high-res viewport (within PIL limits)
-            page = await browser.new_page(
-                viewport={'width': 2560, 'height': 1440},  # 2.5K resolution
-                device_scale_factor=2,  # 2x for high quality screenshots
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
-            )
-            
-            # Set extra HTTP headers to appear more browser-like
-            await page.set_extra_http_headers({
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            })
-
-            # Navigate to the URL with networkidle strategy and longer timeout
-            try:
-                await page.goto(url, wait_until='networkidle', timeout=60000)  # Increased timeout for high-res assets
-            except Exception as e:
-                print(f"Initial navigation strategy failed: {str(e)}")
-                # Fallback to domcontentloaded if networkidle times out
-                await page.goto(url, wait_until='domcontentloaded')
-                # Add a longer delay for high-res content
-                await asyncio.sleep(4)
-
-            # Handle lazy loading by scrolling
-            await handle_lazy_loading(page)
-
-            # Take the screenshot with maximum quality
-            screenshot_bytes = await page.screenshot(
-                full_page=True,
-                type='png',
-                scale='device',
-                animations='disabled'  # Prevent animation frames from affecting quality
-            )
-
-            # Convert to base64
-            base64_image = base64.b64encode(screenshot_bytes).decode('utf-8')
-            
-            return base64_image
+        # Create a new context with high-res viewport (within PIL limits)
+        context = await browser.new_context(
+            viewport={'width': 2560, 'height': 1440},  # 2.5K resolution
+            device_scale_factor=2,  # 2x for high quality screenshots
+            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+            service_workers='block'  # Service workers could serve requests around the route below
+        )
+
+        # Skip trackers and media so the page reaches network idle sooner
+        await context.route(BLOCKED_URL_PATTERN, lambda route: route.abort())
+
+        page = await context.new_page()
+
+        # Set extra HTTP headers to appear more browser-like
+        await page.set_extra_http_headers({
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        })
+
+        # Navigate to the URL with networkidle strategy and longer timeout
+        try:
+            await page.goto(url, wait_until='networkidle', timeout=60000)  # Increased timeout for high-res assets
+        except Exception as e:
+            print(f"Initial navigation strategy failed: {str(e)}")
+            # Fallback to domcontentloaded if networkidle times out
+            await page.goto(url, wait_until='domcontentloaded')
+            # Add a longer delay for high-res content
+            await asyncio.sleep(4)
+
+        # Handle lazy loading by scrolling
+        page_height = await handle_lazy_loading(page)
+
+        # Only pay for the 2x render when the page is short enough to keep the detail
+        scale = 'device' if page_height <= HIGH_DPI_MAX_PAGE_HEIGHT else 'css'
+        print(f"Page height: {page_height}px, capturing at {scale} scale")
+
+        # Take the screenshot as high quality JPEG so neither Chromium nor PIL
+        # has to deal with a multi-megapixel PNG
+        screenshot_bytes = await page.screenshot(
+            full_page=True,
+            type='jpeg',
+            quality=SCREENSHOT_JPEG_QUALITY,
+            scale=scale,
+            animations='disabled'  # Prevent animation frames from affecting quality
+        )
+
+        return screenshot_bytes
 
     except Exception as e:
         print(f"Error taking screenshot: {str(e)}")
         return None
     finally:
-        if browser:
+        if context:
             try:
-                await browser.close()
+                await context.close()
             except Exception as e:
-                print(f"Error closing browser: {str(e)}")
+                print(f"Error closing browser context: {str(e)}")
 
 async def handle_lazy_loading(page):
     """
     Handles lazy loading by scrolling through the page.
     Ensures all images and dynamic content are loaded before taking the screenshot.
+    Returns the page height in CSS pixels.
     """
     try:
-        # Get page height
-        page_height = await page.evaluate('document.documentElement.scrollHeight')
-        viewport_height = await page.evaluate('window.innerHeight')
-        
-        # Scroll in smaller steps for smoother loading
-        step_size = viewport_height // 2  # Smaller steps
-        for current_scroll in range(0, page_height, step_size):
-            await page.evaluate(f'window.scrollTo(0, {current_scroll})')
-            await asyncio.sleep(0.8)  # Longer wait for high-res content
-            
-        # Scroll back to top
-        await page.evaluate('window.scrollTo(0, 0)')
-        
+        # Scroll and wait for images in one evaluate call instead of a round-trip per scroll step
+        page_height = await page.evaluate(LAZY_LOADING_SCRIPT, {'quietMs': SCROLL_QUIET_MS, 'maxWaitMs': SCROLL_MAX_WAIT_MS})
+
         # Wait for network to be idle
         await page.wait_for_load_state('networkidle')
-        
-        # Wait for images to load with high-res check
-        await page.evaluate('''
-            Promise.all([
-                // Wait for all images
-                ...Array.from(document.images).map(img => {
-                    if (img.complete) return Promise.resolve();
-                    return new Promise((resolve) => {
-                        img.onload = img.onerror = resolve;
-                    });
-                }),
-                // Wait for background images
-                ...Array.from(document.querySelectorAll('*')).map(el => {
-                    const style = window.getComputedStyle(el);
-                    if (style.backgroundImage && style.backgroundImage !== 'none') {
-                        return new Promise(resolve => {
-                            const img = new Image();
-                            img.onload = img.onerror = resolve;
-                            img.src = style.backgroundImage.replace(/url\\(['"](.+)['"]\\)/, '$1');
-                        });
-                    }
-                    return Promise.resolve();
-                }).filter(Boolean)
-            ])
-        ''')
-        
+
         # Final wait to ensure everything is rendered
         await asyncio.sleep(1)
-        
+
+        return page_height
+
     except Exception as e:
         print(f"Error during lazy loading handling: {str(e)}")
         # Re-raise the exception to be handled by the caller
-        raise 
\ No newline at end of file
+        raise